@@ -6,17 +6,29 @@ import sys
 import csv
 from tqdm import tqdm
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
 from urllib.parse import urlparse
+from urllib3.util import Retry
 from shopify_scrape.utils import (
     format_url, json_to_file,
     RangeAction, FilePathAction,
-    ValidCsvFile)
+    ValidCsvFile, PositiveIntAction)
 from shopify_scrape.utils import (
     copy_namespace, dummy_context_mgr)
 from typing import Optional
 
+# Largest page size accepted by the products.json and collections.json endpoints
+MAX_PAGE_LIMIT = 250
+# Retries with backoff for rate limited (429) or failed requests
+MAX_RETRIES = Retry(total=5, backoff_factor=1,
+                    status_forcelist=(429, 500, 502, 503, 504),
+                    respect_retry_after_header=True, raise_on_status=False)
 
-def extract(endpoint: str, json_key: str, page_range: Optional[tuple] = None) -> list:
+
+def extract(endpoint: str, json_key: str, page_range: Optional[tuple] = None,
+            session: Optional[requests.Session] = None,
+            limit: Optional[int] = None,
+            item_key: Optional[str] = None) -> list:
     """Extracts either collections or products data from specified page range.
 
     Args:
@@ -24,6 +36,12 @@ def extract(endpoint: str, json_key: str, page_range: Optional[tuple] = None) ->
         json_key (str): 'collections' or 'products'
         page_range (Optional[tuple], optional): Tuple of page range (start, end). 
         Defaults to None.
+        session (Optional[requests.Session], optional): Session to reuse
+        connections with. Defaults to None.
+        limit (Optional[int], optional): Items per page. Defaults to None
+        (endpoint default of 30).
+        item_key (Optional[str], optional): If given, only this key of each
+        item is kept (e.g. 'id'). Defaults to None.
 
     Raises:
         ValueError: Incorrect response content type.
@@ -34,10 +52,13 @@ def extract(endpoint: str, json_key: str, page_range: Optional[tuple] = None) ->
     r_list = list(range(page_range[0], page_range[1]+1)) if page_range else []
     page = 1
     agg_data = []
+    getter = session or requests
 
     while True:
         page_endpoint = endpoint + f'?page={str(page)}'
-        response = requests.get(page_endpoint, timeout=(
+        if limit:
+            page_endpoint += f'&limit={str(limit)}'
+        response = getter.get(page_endpoint, timeout=(
             int(os.environ.get('REQUEST_TIMEOUT', 0)) or 10))
         response.raise_for_status()
         if response.url != page_endpoint:  # to handle potential redirects
@@ -55,21 +76,128 @@ def extract(endpoint: str, json_key: str, page_range: Optional[tuple] = None) ->
         # break loop if empty or want first page
         if not page_has_products or not page_in_range:
             break
-        agg_data.extend(data[json_key])
+        if item_key:
+            agg_data.extend(item[item_key] for item in data[json_key])
+        else:
+            agg_data.extend(data[json_key])
+        # a short page is the last one
+        if limit and len(data[json_key]) < limit:
+            break
         page += 1
     return agg_data
 
 
+def extract_collection_products(url: str, handles: list,
+                                session: Optional[requests.Session] = None,
+                                workers: int = 8) -> tuple:
+    """Concurrently extracts product IDs of each collection. A failed
+    collection is recorded and does not stop the others.
+
+    Args:
+        url (str): Formatted store URL.
+        handles (list): Collection handles.
+        session (Optional[requests.Session], optional): Session to reuse
+        connections with. Defaults to None.
+        workers (int, optional): Number of concurrent requests. Defaults to 8.
+
+    Returns:
+        tuple: Mapping of collection handle to list of product IDs, and
+        mapping of failed collection handle to error message.
+    """
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            handle: executor.submit(
+                extract, f'{url}/collections/{handle}/products.json',
+                'products', session=session, limit=MAX_PAGE_LIMIT,
+                item_key='id')
+            for handle in handles
+        }
+    collection_products = {}
+    errors = {}
+    for handle, future in futures.items():
+        try:
+            collection_products[handle] = future.result()
+        except Exception as err:
+            errors[handle] = str(err)
+    return collection_products, errors
+
+
+def make_session(workers: int = 8) -> requests.Session:
+    """Creates session with connection pool sized for concurrent requests,
+    retrying rate limited requests with backoff.
+
+    Args:
+        workers (int, optional): Number of concurrent requests. Defaults to 8.
+
+    Returns:
+        requests.Session: New session.
+    """
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(
+        pool_connections=1, pool_maxsize=workers, max_retries=MAX_RETRIES)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+def extract_store(url: str, page_range: Optional[tuple] = None,
+                  workers: int = 8) -> dict:
+    """Extracts products, collections and collection membership over
+    shared connections.
+
+    Args:
+        url (str): Formatted store URL.
+        page_range (Optional[tuple], optional): Tuple of page range (start, end)
+        for products and collections. Collection membership is always fully
+        extracted. Defaults to None.
+        workers (int, optional): Number of concurrent requests. Defaults to 8.
+
+    Returns:
+        dict: 'products', 'collections' and 'collection_products' data, and
+        'collection_errors' of collections that failed to extract.
+    """
+    # pages are fixed at 30 items only when a page range is given
+    limit = None if page_range else MAX_PAGE_LIMIT
+    with make_session(workers) as session:
+        # resolve domain redirects once so no endpoint pays for them again,
+        # keeping the given path (the root may redirect to e.g. /password)
+        response = session.head(url, allow_redirects=True, timeout=(
+            int(os.environ.get('REQUEST_TIMEOUT', 0)) or 10))
+        response.raise_for_status()
+        p_url = urlparse(response.url)
+        url = (p_url.scheme + '://' + p_url.netloc +
+               urlparse(url).path.rstrip('/'))
+
+        products = extract(f'{url}/products.json', 'products',
+                           page_range, session=session, limit=limit)
+        collections = extract(f'{url}/collections.json', 'collections',
+                              page_range, session=session, limit=limit)
+        handles = [collection['handle'] for collection in collections]
+        collection_products, collection_errors = extract_collection_products(
+            url, handles, session=session, workers=workers)
+    return {
+        'products': products,
+        'collections': collections,
+        'collection_products': collection_products,
+        'collection_errors': collection_errors,
+    }
+
+
 def extract_url(args: argparse.Namespace) -> dict:
-    """Extracts data from products.json endpoint from specified args.
+    """Extracts data from products.json or collections.json endpoint from
+    specified args. With args.all, extracts both and collection membership
+    (see extract_store_url).
 
     Args:
         args (argparse.Namespace): Parsed args.
 
     Returns:
         dict: Data logged from extraction, including if successful 
-        or errors present.
+        or errors present. With args.all, 'url' is the store URL and
+        'file_path' is the ';'-joined list of files written.
     """
+    if args.all:
+        return extract_store_url(args)
     p = format_url(args.url, scheme='https', return_type='parse_result')
 
     formatted_url = p.geturl()
@@ -110,6 +238,54 @@ def extract_url(args: argparse.Namespace) -> dict:
     return ret
 
 
+def extract_store_url(args: argparse.Namespace) -> dict:
+    """Extracts products, collections and collection membership from
+    specified args, writing one file for each.
+
+    Args:
+        args (argparse.Namespace): Parsed args.
+
+    Returns:
+        dict: Data logged from extraction, including if successful 
+        or errors present. 'url' is the store URL and 'file_path' is the
+        ';'-joined list of files written. Collections that failed to extract
+        are listed in 'collection_errors' and 'error', without discarding
+        the rest.
+    """
+    p = format_url(args.url, scheme='https', return_type='parse_result')
+
+    formatted_url = p.geturl()
+    prefix = args.file_path or p.netloc
+    ret = {
+        'url': formatted_url,
+        'collected_at': str(datetime.now()),
+        'success': False,
+        'error': '',
+        'file_path': '',
+    }
+    try:
+        data = extract_store(formatted_url, args.page_range, args.workers)
+    except Exception as err:
+        ret['error'] = str(err)
+    else:
+        ret['success'] = True
+        ret.update(data)
+        if data['collection_errors']:
+            ret['error'] = 'Failed collections: ' + '; '.join(
+                f'{handle} ({err})'
+                for handle, err in data['collection_errors'].items())
+
+    if ret['success']:
+        fps = []
+        for json_key in ('products', 'collections', 'collection_products'):
+            json_data = data[json_key]
+            fp = os.path.join(args.dest_path, f'{prefix}.{json_key}.json')
+            json_to_file(fp, json_data)
+            fps.append(fp)
+        ret['file_path'] = ';'.join(fps)
+    return ret
+
+
 def extract_batch(args: argparse.Namespace) -> list:
     """Extracts multiple URLs given in csv file.
 
@@ -161,7 +337,8 @@ def extract_batch(args: argparse.Namespace) -> list:
             row = rows[i]
             url = row[url_column_idx]
             extract_args = copy_namespace(
-                args, ['collections', 'page_range', 'dest_path', 'file_path'])
+                args, ['collections', 'all', 'workers', 'page_range',
+                       'dest_path', 'file_path'])
             extract_args.url = url
             data = extract_url(extract_args)
             row_results.append(data)
@@ -189,9 +366,19 @@ def parse_args(argv=sys.argv[1:]):
                                help="""Inclusive page range as tuple to extract. 
                                There are 30 items per page. If not provided, 
                                all pages with products will be taken.""")
-    parent_parser.add_argument('-c', '--collections', action='store_true',
-                               help="""If true, extracts '/collections.json' 
-                               instead of '/products.json'""")
+    mode_group = parent_parser.add_mutually_exclusive_group()
+    mode_group.add_argument('-c', '--collections', action='store_true',
+                            help="""If true, extracts '/collections.json' 
+                            instead of '/products.json'""")
+    mode_group.add_argument('-a', '--all', action='store_true',
+                            help="""If true, extracts '/products.json', 
+                            '/collections.json' and the product IDs of each 
+                            collection in a single pass""")
+    parent_parser.add_argument('-w', '--workers', type=int, default=8,
+                               action=PositiveIntAction,
+                               help="""Number of concurrent requests used
+                               to extract collection product IDs with --all.
+                               Defaults to 8.""")
 
     parser = argparse.ArgumentParser(add_help=False)
     subparsers = parser.add_subparsers(dest="subparser_name")
@@ -205,7 +392,8 @@ def parse_args(argv=sys.argv[1:]):
                             action=FilePathAction,
                             help="""File path to write. Defaults to 
                             '[dest_path]/[url].products' or 
-                            '[dest_path]/[url].collections'""")
+                            '[dest_path]/[url].collections'. With --all,
+                            used as prefix of each file written.""")
 
     # for batch subcommand
     batch_parser = subparsers.add_parser('batch', parents=[parent_parser])
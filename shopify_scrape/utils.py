@@ -203,6 +203,14 @@ class FilePathAction(argparse.Action):
         setattr(args, self.dest, value)
 
 
+class PositiveIntAction(argparse.Action):
+    def __call__(self, parser, args, value: int, option_string=None):
+        if value < 1:
+            raise ValueError(
+                f"Given arg for {self.dest} of {value} must be a positive integer.")
+        setattr(args, self.dest, value)
+
+
 class ValidCsvFile(argparse.Action):
     def __call__(self, parser, args, value: str, option_string=None):
         if not value.endswith('.csv'):
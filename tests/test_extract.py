@@ -1,9 +1,83 @@
 import pytest
 import os
 import argparse
+import threading
+import requests
+from urllib.parse import urlparse, parse_qs
 
+import shopify_scrape.extract
 from shopify_scrape.extract import (
-    extract, extract_url, parse_args, extract_batch)
+    extract, extract_url, parse_args, extract_batch,
+    extract_collection_products, make_session, MAX_PAGE_LIMIT)
+
+
+class FakeResponse:
+    def __init__(self, url, data=None, status_code=200):
+        self.url = url
+        self.status_code = status_code
+        self.headers = {'Content-Type': 'application/json; charset=utf-8'}
+        self._data = data
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.exceptions.HTTPError(
+                f'{self.status_code} Client Error for url: {self.url}')
+
+    def json(self):
+        return self._data
+
+
+class FakeStoreSession:
+    """Stub session serving a small store at https://www.shop.com,
+    redirecting HEAD requests from any other URL to its password page."""
+    base_url = 'https://www.shop.com'
+    products = [{'id': i, 'title': f'p{i}'} for i in range(1, 8)]
+    collections = [{'handle': 'a'}, {'handle': 'b'}, {'handle': 'broken'}]
+    members = {'a': [1, 2, 3, 4, 5], 'b': [6, 7]}
+
+    def __init__(self):
+        self.urls = []
+        self.threads = set()
+        self.lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def head(self, url, **kwargs):
+        return FakeResponse(self.base_url + '/password')
+
+    def get(self, url, **kwargs):
+        with self.lock:
+            self.urls.append(url)
+            self.threads.add(threading.get_ident())
+        p = urlparse(url)
+        query = parse_qs(p.query)
+        page = int(query['page'][0])
+        limit = int(query.get('limit', ['30'])[0])
+        if p.path == '/collections/broken/products.json':
+            return FakeResponse(url, status_code=429)
+        if p.path == '/products.json':
+            key, items = 'products', self.products
+        elif p.path == '/collections.json':
+            key, items = 'collections', self.collections
+        else:
+            handle = p.path.split('/')[2]
+            key = 'products'
+            items = [prod for prod in self.products
+                     if prod['id'] in self.members[handle]]
+        return FakeResponse(
+            url, {key: items[(page - 1) * limit:page * limit]})
+
+
+@pytest.fixture
+def fake_session(monkeypatch):
+    session = FakeStoreSession()
+    monkeypatch.setattr(shopify_scrape.extract, 'make_session',
+                        lambda workers=8: session)
+    return session
 
 
 @pytest.mark.parametrize('args_str, expectation',
@@ -17,6 +91,10 @@ from shopify_scrape.extract import (
                              ('url example.com -p h a'.split(),
                               pytest.raises(argparse.ArgumentTypeError)),
                              ('url example.com -f bad_fp$ -p 0 1'.split(),
+                              pytest.raises(ValueError)),
+                             ('url example.com -a -w 0'.split(),
+                              pytest.raises(ValueError)),
+                             ('url example.com -a -w -1'.split(),
                               pytest.raises(ValueError))
                          ]
                          )
@@ -61,6 +139,77 @@ def test_extract_collections():
     assert len(collections) > 0
 
 
+def test_extract_products_ids_with_limit():
+    session = FakeStoreSession()
+    ids = extract('https://www.shop.com/products.json', 'products',
+                  session=session, limit=5, item_key='id')
+    assert ids == [1, 2, 3, 4, 5, 6, 7]
+    assert session.urls == [
+        f'https://www.shop.com/products.json?page={page}&limit=5'
+        for page in (1, 2)]
+
+
+def test_extract_collection_products():
+    session = FakeStoreSession()
+    mapping, errors = extract_collection_products(
+        'https://www.shop.com', ['a', 'b', 'broken'], session=session,
+        workers=3)
+    assert mapping == {'a': [1, 2, 3, 4, 5], 'b': [6, 7]}
+    assert list(errors.keys()) == ['broken']
+    assert '429' in errors['broken']
+    assert all(f'limit={MAX_PAGE_LIMIT}' in url for url in session.urls)
+
+
+def test_extract_url_all_with_stub(fake_session, products_dir):
+    fp = 'stub_store'
+    args_str = f'url shop.com -a -w 3 -d {products_dir} -f {fp}'
+    data = extract_url(parse_args(args_str.split()))
+    assert data['success'] is True
+    assert data['collection_products'] == FakeStoreSession.members
+    assert list(data['collection_errors'].keys()) == ['broken']
+    assert 'broken' in data['error']
+    for json_key in ('products', 'collections', 'collection_products'):
+        assert os.path.exists(
+            os.path.join(products_dir, f'{fp}.{json_key}.json'))
+    # redirect resolved once without its path, one request per short page
+    assert all(url.startswith('https://www.shop.com/')
+               for url in fake_session.urls)
+    assert not any('/password' in url for url in fake_session.urls)
+    assert len(fake_session.urls) == 5
+    assert all(f'limit={MAX_PAGE_LIMIT}' in url for url in fake_session.urls)
+    assert ('https://www.shop.com/collections/a/products.json'
+            f'?page=1&limit={MAX_PAGE_LIMIT}') in fake_session.urls
+
+
+def test_make_session_retries_rate_limits():
+    with make_session(4) as session:
+        retries = session.get_adapter('https://www.shop.com').max_retries
+    assert 429 in retries.status_forcelist
+    assert retries.respect_retry_after_header
+
+
+def test_extract_url_all_with_page_range(fake_session, products_dir):
+    args_str = f'url shop.com -a -p 1 1 -d {products_dir}'
+    data = extract_url(parse_args(args_str.split()))
+    assert len(data['products']) == 7
+    assert 'https://www.shop.com/products.json?page=1' in fake_session.urls
+
+
+def test_extract_url_all(good_shop_domain, products_dir):
+    fp = 'test_file'
+    args_str = f'url {good_shop_domain} -a -p 1 1 -d {products_dir} -f {fp}'
+    data = extract_url(parse_args(args_str.split()))
+    assert data['success'] is True
+    for json_key in ('products', 'collections', 'collection_products'):
+        assert os.path.exists(
+            os.path.join(products_dir, f'{fp}.{json_key}.json'))
+
+
+def test_extract_url_all_and_collections_args():
+    with pytest.raises(SystemExit):
+        parse_args('url example.com -a -c'.split())
+
+
 def test_extract_batch(products_dir):
     args_str = f'batch examples/urls.csv urls -l logs/pytest_log.csv -d {products_dir} -p 1 1'
     args = parse_args(args_str.split())